@@ -1,188 +1,303 @@
 import re
+import io
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
 from sympy import symbols, Eq, solve
+from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
+from sklearn.feature_extraction.text import HashingVectorizer
+from core.loader import load_documents
+from core.mmr import index_documents, mmr_search
 from core.vectorstore import build_vector_store
-from langchain_community.document_loaders import PyPDFLoader
+
+def _keyword_re(words):
+    """Compile keywords into one alternation regex (same substring semantics as `word in text`)."""
+    return re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE)
+
+# Expanded keywords + more flexible matching
+MATH_KEYWORDS = (
+    "x", "y", "z", "equation", "solve", "calculate", "value", "algebra", 
+    "add", "subtract", "multiply", "divide", "number", "sum", "difference",
+    "product", "quotient", "fraction", "decimal", "percentage", "ratio",
+    "area", "perimeter", "volume", "square", "cube", "root", "power",
+    "how many", "how much", "total", "altogether", "left", "more", "less",
+    "times", "divided", "plus", "minus", "equal", "greater", "smaller",
+    "digit", "place value", "round", "estimate", "measure", "length",
+    "width", "height", "math", "maths", "mathematics", "problem"
+)
+GENERIC_WORDS = ("what is", "explain", "tell me", "describe")
+ENGLISH_KEYWORDS = ("read", "reading", "grammar", "vocabulary", "writing", "poem", "literature", "word", "sentence", "story", "noun", "verb", "adjective", "paragraph")
+EVS_KEYWORDS = ("environment", "plant", "animal", "season", "pollution", "conservation", "resource", "nature", "earth", "water", "air", "living", "non-living")
+
+# ✅ Single-pass matchers compiled once at import
+MATH_RE = _keyword_re(MATH_KEYWORDS)
+GENERIC_RE = _keyword_re(GENERIC_WORDS)
+ENGLISH_RE = _keyword_re(ENGLISH_KEYWORDS)
+EVS_RE = _keyword_re(EVS_KEYWORDS)
+
+# Simple "<expr in x> = <number expr>" equations
+_EQ_RE = re.compile(r"([0-9xX+\-*/\s]+)=([0-9+\-*/\s]+)")
+
+# ✅ SymPy parsing instead of raw eval(): handles "2x" natively (no "*x" rewrite)
+_X = symbols('x')
+_TRANSFORMATIONS = standard_transformations + (implicit_multiplication_application,)
+
+@lru_cache(maxsize=256)
+def _solve_equation_cached(question: str):
+    """Parse and solve the first simple equation in a question; repeats hit the cache."""
+    try:
+        match = _EQ_RE.search(question)
+        if not match:
+            return None
+        
+        left_expr, right_expr = match.groups()
+        left = parse_expr(left_expr.replace("X", "x"), transformations=_TRANSFORMATIONS, local_dict={"x": _X})
+        right = parse_expr(right_expr, transformations=_TRANSFORMATIONS, local_dict={"x": _X})
+        solution = solve(Eq(left, right), _X)
+        
+        if solution:
+            return f"Solution: x = {solution}"
+        else:
+            return "No real solution found."
+    except Exception:
+        return None
+
+# ✅ IMPROVED: Less strict prompt for better responses
+PROMPT_HEADER = """
+You are a helpful {subject} teacher for elementary school students.
+
+INSTRUCTIONS:
+1. Read the Textbook Context below carefully
+2. Answer the question using ONLY information from the Textbook Context
+3. If you find the answer in the context, explain it clearly in simple language
+4. If the exact answer is NOT in the context, say: "I cannot find this information in the textbook."
+5. Use examples from the textbook when available
+6. Keep your answer suitable for elementary students
+
+Textbook Context:
+"""
+PROMPT_HISTORY_HEADER = "\n\nChat History:\n"
+PROMPT_QUESTION_HEADER = "\n\nStudent Question:\n"
+PROMPT_FOOTER = "\n\nYour Answer:\n"
+
+# Cache sizes for repeated (normalized) questions
+RETRIEVAL_CACHE_SIZE = 256
+ANSWER_CACHE_SIZE = 128
+
+_WS_RE = re.compile(r"\s+")
+
+def _normalize_question(question: str) -> str:
+    """Collapse case and whitespace so near-identical questions share cache entries."""
+    return _WS_RE.sub(" ", question.strip().lower())
+
+# ✅ Hashed bag-of-words for the hallucination guard (words longer than 3 characters)
+_OVERLAP_VECTORIZER = HashingVectorizer(
+    n_features=2**16,
+    token_pattern=r"\S{4,}",
+    alternate_sign=False,
+    binary=True,
+    norm=None,
+    dtype=np.int8
+)
 
 class BaseAgent:
-    def __init__(self, subject: str, pdf_path: str, llm, memory):
+    def __init__(self, subject: str, pdf_path: str, llm, memory, vectordb=None, docs=None):
         self.subject = subject
         self.pdf_path = pdf_path
         self.llm = llm
         self.memory = memory
         
-        # Load textbook
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
-        print(f"[BaseAgent] Loaded {len(docs)} pages from {pdf_path}")
+        # ✅ Reuse a prebuilt vector store instead of reloading + re-embedding the PDF
+        if vectordb is None:
+            # Load textbook (skipped when the caller already parsed it)
+            if docs is None:
+                docs = load_documents(pdf_path)
+            print(f"[BaseAgent] Loaded {len(docs)} pages from {pdf_path}")
+            
+            if not docs:
+                raise ValueError(f"No documents found in {pdf_path}")
+            
+            vectordb = build_vector_store(subject, docs)
+        
+        self.vectordb = vectordb
+        self._prompt_header = PROMPT_HEADER.format(subject=subject)
         
-        if not docs:
-            raise ValueError(f"No documents found in {pdf_path}")
+        # ✅ FAISS position -> chunk lookup for MMR results
+        self._docs = index_documents(self.vectordb)
         
-        self.vectordb = build_vector_store(subject, docs)
+        # ✅ Per-agent caches keyed on the normalized question
+        self._retrieve = lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)(self._retrieve_uncached)
+        self._answer_cache = OrderedDict()
+        self._answer_lock = threading.Lock()  # MetaAgent queries agents from worker threads
     
     def _solve_equation(self, question: str):
         """Detect and solve simple math equations using SymPy."""
-        try:
-            if self.subject.lower() != "math":
-                return None
-            
-            match = re.search(r"([0-9xX\+\-\*/\s]+)=([0-9\+\-\*/\s]+)", question)
-            if not match:
-                return None
-            
-            left_expr, right_expr = match.groups()
-            x = symbols('x')
-            left_expr = left_expr.replace("X", "x")
-            eq = Eq(eval(left_expr.replace("x", "*x")), eval(right_expr))
-            solution = solve(eq, x)
-            
-            if solution:
-                return f"Solution: x = {solution}"
-            else:
-                return "No real solution found."
-        except Exception:
+        if self.subject.lower() != "math":
+            return None
+        return _solve_equation_cached(question)
+    
+    def _retrieve_uncached(self, q_norm: str):
+        """Embed + MMR-retrieve chunks for a normalized question; returns the context or None."""
+        q_vec = np.asarray(self.vectordb.embeddings.embed_query(q_norm), dtype=np.float32)
+        hits = mmr_search(
+            self.vectordb.index,
+            q_vec,
+            k=5,              # ✅ Increased from 3 to 5 for better coverage
+            fetch_k=20,       # ✅ Increased from 10 to 20 for broader search
+            lambda_mult=0.5   # ✅ More diversity (0.5) to get varied chunks
+        )
+        docs = [self._docs[i] for i in hits]
+        
+        # ✅ DEBUG: Print retrieved chunks
+        print(f"[DEBUG] Retrieved {len(docs)} documents")
+        for i, doc in enumerate(docs):
+            print(f"[DEBUG] Chunk {i+1} (length: {len(doc.page_content)}): {doc.page_content[:200]}...")
+        
+        # Check if documents are meaningful (relaxed threshold)
+        if not docs or all(len(d.page_content.strip()) < 30 for d in docs):  # ✅ Lowered from 50 to 30
             return None
+        
+        # Build context
+        return "\n\n".join(d.page_content for d in docs)  # ✅ Double newline for better separation
     
-    def query(self, question: str) -> str:
+    def _cached_answer(self, q_norm: str, question: str, memory):
+        """Return a previously generated answer (recording the exchange), or None."""
+        with self._answer_lock:
+            answer = self._answer_cache.get(q_norm)
+            if answer is None:
+                return None
+            self._answer_cache.move_to_end(q_norm)
+        
+        memory.chat_memory.add_user_message(question)
+        memory.chat_memory.add_ai_message(answer)
+        return answer
+    
+    def _remember_answer(self, q_norm: str, answer: str):
+        """Store a generated answer, evicting the least recently used one."""
+        with self._answer_lock:
+            self._answer_cache[q_norm] = answer
+            self._answer_cache.move_to_end(q_norm)
+            if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+                self._answer_cache.popitem(last=False)
+    
+    def _prepare(self, question: str, q_norm: str, memory):
+        """
+        Run filters, retrieval and prompt building for a question.
+        Returns (answer, context, prompt); answer is set (and already saved
+        to memory) when the question is handled without the LLM.
+        """
         # Save user message into memory
-        self.memory.chat_memory.add_user_message(question)
+        memory.chat_memory.add_user_message(question)
         
-        # ✅ FIXED: More flexible subject filter for Math
-        q_lower = question.lower()
+        # ✅ Try to solve math directly first (an equation always passes the Math filter)
+        eq_solution = self._solve_equation(question)
+        if eq_solution:
+            memory.chat_memory.add_ai_message(eq_solution)
+            return eq_solution, None, None
         
+        # ✅ FIXED: More flexible subject filter for Math
         if self.subject.lower() == "math":
-            # Expanded keywords + more flexible matching
-            math_keywords = [
-                "x", "y", "z", "equation", "solve", "calculate", "value", "algebra", 
-                "add", "subtract", "multiply", "divide", "number", "sum", "difference",
-                "product", "quotient", "fraction", "decimal", "percentage", "ratio",
-                "area", "perimeter", "volume", "square", "cube", "root", "power",
-                "how many", "how much", "total", "altogether", "left", "more", "less",
-                "times", "divided", "plus", "minus", "equal", "greater", "smaller",
-                "digit", "place value", "round", "estimate", "measure", "length",
-                "width", "height", "math", "maths", "mathematics", "problem"
-            ]
-            
             # ✅ FIXED: Allow if ANY keyword matches OR if it's a simple number question
-            has_math_keyword = any(word in q_lower for word in math_keywords)
+            has_math_keyword = bool(MATH_RE.search(question))
             has_numbers = any(char.isdigit() for char in question)
             
             # Only reject if clearly not math-related
             if not has_math_keyword and not has_numbers:
                 # Check if question is very generic
-                generic_words = ["what is", "explain", "tell me", "describe"]
-                if any(gen in q_lower for gen in generic_words) and len(question.split()) < 10:
+                if GENERIC_RE.search(question) and len(question.split()) < 10:
                     response = f"Sorry, I can only answer Math questions."
-                    self.memory.chat_memory.add_ai_message(response)
-                    return response
+                    memory.chat_memory.add_ai_message(response)
+                    return response, None, None
         
         if self.subject.lower() == "english":
-            english_keywords = ["read", "reading", "grammar", "vocabulary", "writing", "poem", "literature", "word", "sentence", "story", "noun", "verb", "adjective", "paragraph"]
-            if not any(word in q_lower for word in english_keywords):
+            if not ENGLISH_RE.search(question):
                 response = f"Sorry, I can only answer English questions."
-                self.memory.chat_memory.add_ai_message(response)
-                return response
+                memory.chat_memory.add_ai_message(response)
+                return response, None, None
         
         if self.subject.lower() == "evs":
-            evs_keywords = ["environment", "plant", "animal", "season", "pollution", "conservation", "resource", "nature", "earth", "water", "air", "living", "non-living"]
-            if not any(word in q_lower for word in evs_keywords):
+            if not EVS_RE.search(question):
                 response = f"Sorry, I can only answer EVS questions."
-                self.memory.chat_memory.add_ai_message(response)
-                return response
-        
-        # Try to solve math directly
-        eq_solution = self._solve_equation(question)
-        if eq_solution:
-            self.memory.chat_memory.add_ai_message(eq_solution)
-            return eq_solution
+                memory.chat_memory.add_ai_message(response)
+                return response, None, None
         
         # ✅ NEW: MMR retrieval with MORE candidates and DEBUG output
         print(f"\n[DEBUG] Question: {question}")
         
-        retriever = self.vectordb.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k": 5,              # ✅ Increased from 3 to 5 for better coverage
-                "fetch_k": 20,       # ✅ Increased from 10 to 20 for broader search
-                "lambda_mult": 0.5   # ✅ More diversity (0.5) to get varied chunks
-            }
-        )
-        docs = retriever.invoke(question)
-        
-        # ✅ DEBUG: Print retrieved chunks
-        print(f"[DEBUG] Retrieved {len(docs)} documents")
-        for i, doc in enumerate(docs):
-            print(f"[DEBUG] Chunk {i+1} (length: {len(doc.page_content)}): {doc.page_content[:200]}...")
-        
-        # Check if documents are meaningful (relaxed threshold)
-        if not docs or all(len(d.page_content.strip()) < 30 for d in docs):  # ✅ Lowered from 50 to 30
+        context = self._retrieve(q_norm)
+        if context is None:
             answer = f"Sorry, I don't have information on this topic in the {self.subject} textbook."
-            self.memory.chat_memory.add_ai_message(answer)
-            return answer
+            memory.chat_memory.add_ai_message(answer)
+            return answer, None, None
         
-        # Build context + history
-        context = "\n\n".join([d.page_content for d in docs])  # ✅ Double newline for better separation
-        history = "\n".join([f"{m['type']}: {m['content']}" for m in self.memory.chat_memory.messages[-10:]])
+        # Build history
+        history = memory.chat_memory.history()
         
         print(f"[DEBUG] Context length: {len(context)} characters")
         
-        # ✅ IMPROVED: Less strict prompt for better responses
-        prompt = f"""
-You are a helpful {self.subject} teacher for elementary school students.
-
-INSTRUCTIONS:
-1. Read the Textbook Context below carefully
-2. Answer the question using ONLY information from the Textbook Context
-3. If you find the answer in the context, explain it clearly in simple language
-4. If the exact answer is NOT in the context, say: "I cannot find this information in the textbook."
-5. Use examples from the textbook when available
-6. Keep your answer suitable for elementary students
-
-Textbook Context:
-{context}
-
-Chat History:
-{history}
-
-Student Question:
-{question}
-
-Your Answer:
-"""
+        # ✅ Assemble the prompt in one buffer from pre-formatted pieces
+        buf = io.StringIO()
+        buf.write(self._prompt_header)
+        buf.write(context)
+        buf.write(PROMPT_HISTORY_HEADER)
+        buf.write(history)
+        buf.write(PROMPT_QUESTION_HEADER)
+        buf.write(question)
+        buf.write(PROMPT_FOOTER)
+        prompt = buf.getvalue()
         
-        try:
-            response = self.llm.invoke(prompt)
-            if hasattr(response, "content"):
-                response = response.content
-            response = str(response).strip()
-            
-            print(f"[DEBUG] LLM Response length: {len(response)} characters")
-            print(f"[DEBUG] Response preview: {response[:200]}...")
+        return None, context, prompt
+    
+    def _check_response(self, response, context: str) -> str:
+        """Normalize an LLM response and apply the hallucination guard."""
+        if hasattr(response, "content"):
+            response = response.content
+        response = str(response).strip()
+        
+        print(f"[DEBUG] LLM Response length: {len(response)} characters")
+        print(f"[DEBUG] Response preview: {response[:200]}...")
+        
+        # ✅ RELAXED: Less aggressive hallucination detection
+        if len(response) > 400 and "cannot find" not in response.lower():
+            # Check if response has reasonable overlap with context
+            X = _OVERLAP_VECTORIZER.transform([context, response])
+            context_words, response_words = X[0], X[1]
             
-            # ✅ RELAXED: Less aggressive hallucination detection
-            if len(response) > 400 and "cannot find" not in response.lower():
-                # Check if response has reasonable overlap with context
-                context_lower = context.lower()
-                response_lower = response.lower()
+            if response_words.nnz and context_words.nnz:
+                overlap = context_words.multiply(response_words).nnz
+                overlap_ratio = overlap / response_words.nnz
                 
-                # Extract meaningful words (more than 3 characters)
-                response_words = set([w for w in response_lower.split() if len(w) > 3])
-                context_words = set([w for w in context_lower.split() if len(w) > 3])
+                print(f"[DEBUG] Word overlap ratio: {overlap_ratio:.2%}")
                 
-                if response_words and context_words:
-                    overlap = len(response_words & context_words)
-                    overlap_ratio = overlap / len(response_words) if response_words else 0
-                    
-                    print(f"[DEBUG] Word overlap ratio: {overlap_ratio:.2%}")
-                    
-                    # ✅ RELAXED: Lowered from 15% to 10%
-                    if overlap_ratio < 0.10:
-                        response = f"I cannot find this information in the {self.subject} textbook."
+                # ✅ RELAXED: Lowered from 15% to 10%
+                if overlap_ratio < 0.10:
+                    response = f"I cannot find this information in the {self.subject} textbook."
+        
+        return response
+    
+    def query(self, question: str, memory=None) -> str:
+        # Per-call memory lets callers stay stateless without rebuilding the agent
+        if memory is None:
+            memory = self.memory
         
+        # ✅ Exact repeat of a recent question: skip retrieval and generation
+        q_norm = _normalize_question(question)
+        answer = self._cached_answer(q_norm, question, memory)
+        if answer is not None:
+            return answer
+        
+        answer, context, prompt = self._prepare(question, q_norm, memory)
+        if answer is not None:
+            return answer
+        
+        try:
+            response = self._check_response(self.llm.invoke(prompt), context)
+            self._remember_answer(q_norm, response)
         except Exception as e:
             print(f"[DEBUG] Error: {e}")
             response = f"Error from model: {e}"
         
         # Save AI response into memory
-        self.memory.chat_memory.add_ai_message(response)
+        memory.chat_memory.add_ai_message(response)
         return response
@@ -1,13 +1,53 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import numpy as np
-from langchain_ollama import OllamaEmbeddings
 from core.memory import PersistentMemory
-from agents.base_agent import BaseAgent
+from core.vectorstore import get_embeddings
+
+# Sub-question separators: '?', the word 'and', newlines
+_SPLIT_RE = re.compile(r"\?|\band\b|\n")
+
+# ✅ Explicit keyword overrides, compiled once (checked in this order)
+_KEYWORD_OVERRIDES = (
+    ("Math", re.compile(r"math|solve|equation|calculate", re.IGNORECASE)),
+    ("English", re.compile(r"english|read|grammar|literature", re.IGNORECASE)),
+    ("EVS", re.compile(r"evs|plant|environment|season", re.IGNORECASE)),
+)
+
+# Sub-questions answered at once (Ollama queues anything beyond a few parallel requests)
+ROUTE_WORKERS = 4
+
+# Per-text LRU of normalized embeddings (shared across questions and reruns)
+EMBED_CACHE_SIZE = 512
+_EMBED_CACHE = OrderedDict()
+
+def _embed_batch(texts):
+    """
+    Return L2-normalized embeddings for texts, one row per text.
+    Texts already in the cache are reused; the misses go to Ollama in a single call.
+    """
+    misses = [t for t in dict.fromkeys(texts) if t not in _EMBED_CACHE]
+    if misses:
+        mat = np.asarray(get_embeddings().embed_documents(misses), dtype=np.float32)
+        mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+        for t, vec in zip(misses, mat):
+            vec.setflags(write=False)  # Shared by every cache hit
+            _EMBED_CACHE[t] = vec
+    
+    rows = []
+    for t in texts:
+        _EMBED_CACHE.move_to_end(t)
+        rows.append(_EMBED_CACHE[t])
+    
+    while len(_EMBED_CACHE) > EMBED_CACHE_SIZE:
+        _EMBED_CACHE.popitem(last=False)
+    
+    return np.stack(rows)
 
 class MetaAgent:
     def __init__(self, agents):
         self.agents = agents
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
         
         # Subject reference texts for routing
         subject_texts = {
@@ -16,72 +56,90 @@ class MetaAgent:
             "EVS": "environment, plants, animals, seasons, weather, community, safety, nature, conservation, resources"
         }
         
-        self.subject_vectors = {
-            k: self.embeddings.embed_query(v) for k, v in subject_texts.items()
-        }
+        # ✅ Normalized (n_subjects, D) matrix, embedded in a single batched call
+        self._subj_names = list(subject_texts)
+        self._subj_mat = _embed_batch(list(subject_texts.values()))
     
     def _split_questions(self, text: str):
         """
         Split multi-part questions into smaller sub-questions.
         Splits on ' and ', '?', or newlines.
         """
-        parts = re.split(r"\?|\band\b|\n", text)
+        parts = _SPLIT_RE.split(text)
         return [p.strip() for p in parts if p.strip()]
     
-    def _find_subject(self, question: str):
-        """Find the best subject for a sub-question with confidence check."""
-        q_vec = self.embeddings.embed_query(question)
-        sims = {
-            subj: np.dot(q_vec, vec) / (np.linalg.norm(q_vec) * np.linalg.norm(vec))
-            for subj, vec in self.subject_vectors.items()
-        }
+    def _keyword_subject(self, question: str):
+        """Return the subject forced by an explicit keyword, or None."""
+        for subject, pattern in _KEYWORD_OVERRIDES:
+            if pattern.search(question):
+                return subject
+        return None
+    
+    def _classify(self, sub_questions):
+        """
+        Find (subject, confidence) for every sub-question.
+        Keyword overrides are applied first; the remaining questions are
+        embedded in one batch and scored against all subjects with one matmul.
+        """
+        results = []
+        need_embed = []
+        for q in sub_questions:
+            # ✅ Explicit keyword overrides (highest priority, skip embedding)
+            subject = self._keyword_subject(q)
+            results.append((subject, 1.0) if subject else None)
+            if subject is None:
+                need_embed.append(q)
         
-        # Pick subject with highest similarity
-        best_subject = max(sims, key=sims.get)
-        confidence = sims[best_subject]
+        if not need_embed:
+            return results
         
-        # ✅ Explicit keyword overrides (highest priority)
-        q_lower = question.lower()
-        if "math" in q_lower or "solve" in q_lower or "equation" in q_lower or "calculate" in q_lower:
-            return "Math", 1.0
-        elif "english" in q_lower or "read" in q_lower or "grammar" in q_lower or "literature" in q_lower:
-            return "English", 1.0
-        elif "evs" in q_lower or "plant" in q_lower or "environment" in q_lower or "season" in q_lower:
-            return "EVS", 1.0
+        sims = _embed_batch(need_embed) @ self._subj_mat.T
+        best = sims.argmax(axis=1)
         
-        # ✅ NEW: Low confidence handling
-        if confidence < 0.5:  # Ambiguous question
-            print(f"[MetaAgent] Low confidence ({confidence:.2f}) for: '{question}'")
-            print(f"[MetaAgent] Similarity scores: {sims}")
-            # Try best guess anyway
-            return best_subject, confidence
+        rows = iter(zip(need_embed, sims, best))
+        for i, result in enumerate(results):
+            if result is not None:
+                continue
+            q, q_sims, idx = next(rows)
+            best_subject = self._subj_names[idx]
+            confidence = float(q_sims[idx])
+            
+            # ✅ NEW: Low confidence handling
+            if confidence < 0.5:  # Ambiguous question
+                print(f"[MetaAgent] Low confidence ({confidence:.2f}) for: '{q}'")
+                print(f"[MetaAgent] Similarity scores: { {s: round(float(v), 3) for s, v in zip(self._subj_names, q_sims)} }")
+                # Try best guess anyway
+            
+            results[i] = (best_subject, confidence)
         
-        return best_subject, confidence
+        return results
+    
+    def _find_subject(self, question: str):
+        """Find the best subject for a sub-question with confidence check."""
+        return self._classify([question])[0]
+    
+    def _answer(self, sub_q: str, subject: str, confidence: float):
+        # Check if subject agent exists
+        if subject not in self.agents:
+            return f"**Error**: {subject} subject not available. Please upload the PDF."
+        
+        # ✅ Stateless: fresh memory for each query, reusing the prebuilt agent
+        ans = self.agents[subject].query(sub_q, memory=PersistentMemory(subject))
+        
+        # ✅ Show confidence in meta agent response
+        confidence_emoji = "🟢" if confidence > 0.7 else "🟡" if confidence > 0.5 else "🔴"
+        return f"{confidence_emoji} **{subject} Answer** (confidence: {confidence:.0%}):\n{ans}"
     
     def route(self, question: str):
         sub_questions = self._split_questions(question)
-        answers = []
+        if not sub_questions:
+            return ""
+        classified = self._classify(sub_questions)
         
-        for sub_q in sub_questions:
-            subject, confidence = self._find_subject(sub_q)
-            
-            # Check if subject agent exists
-            if subject not in self.agents:
-                answers.append(f"**Error**: {subject} subject not available. Please upload the PDF.")
-                continue
-            
-            # ✅ Stateless: fresh memory for each query
-            temp_agent = BaseAgent(
-                subject,
-                self.agents[subject].pdf_path,
-                self.agents[subject].llm,
-                PersistentMemory(subject)
+        # ✅ Sub-questions are independent: answer them concurrently (Ollama calls are I/O-bound)
+        with ThreadPoolExecutor(max_workers=min(len(sub_questions), ROUTE_WORKERS)) as pool:
+            answers = pool.map(
+                lambda item: self._answer(item[0], *item[1]),
+                zip(sub_questions, classified)
             )
-            
-            ans = temp_agent.query(sub_q)
-            
-            # ✅ Show confidence in meta agent response
-            confidence_emoji = "🟢" if confidence > 0.7 else "🟡" if confidence > 0.5 else "🔴"
-            answers.append(f"{confidence_emoji} **{subject} Answer** (confidence: {confidence:.0%}):\n{ans}")
-        
-        return "\n\n---\n\n".join(answers)
+            return "\n\n---\n\n".join(answers)
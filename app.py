@@ -1,13 +1,14 @@
+from config import MODEL_NAME  # First: sets BLAS/OpenMP thread defaults before numpy loads
 import streamlit as st
 import os
 import shutil
+import hashlib
 from langchain_ollama import OllamaLLM
 from agents.base_agent import BaseAgent
 from agents.meta_agent import MetaAgent
 from core.memory import load_persistent_memory
 from core.loader import load_documents
-from core.vectorstore import build_vector_store, load_vector_store
-from config import MODEL_NAME
+from core.vectorstore import build_vector_store, load_vector_store, read_content_hash
 
 st.set_page_config(page_title="Agentic RAG School Assistant", layout="wide")
 st.title("🎓 Agentic RAG School Assistant")
@@ -40,8 +41,8 @@ for subject in subjects:
     )
     
     if uploaded_file is not None:
-        # Get file hash to detect new uploads
-        file_hash = hash(uploaded_file.getvalue())
+        # Get deterministic content hash to detect new uploads
+        file_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
         
         # Check if this is a new file (different from previous upload)
         is_new_file = st.session_state.uploaded_file_hashes[subject] != file_hash
@@ -56,16 +57,33 @@ for subject in subjects:
             with open(file_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
             
+            # Remove old agent from session
+            if subject in st.session_state.agents:
+                del st.session_state.agents[subject]
+            
+            # ✅ Same content as the persisted index: reuse it instead of re-embedding
+            if read_content_hash(subject) == file_hash:
+                try:
+                    vectordb = load_vector_store(subject)
+                    
+                    if vectordb:
+                        subject_memory = load_persistent_memory(subject)
+                        agent = BaseAgent(subject, file_path, qa_pipeline, subject_memory, vectordb=vectordb)
+                        st.session_state.agents[subject] = agent
+                        st.session_state.textbooks_uploaded[subject] = True
+                        st.session_state.uploaded_file_hashes[subject] = file_hash
+                        
+                        st.sidebar.success(f"✅ {subject} textbook unchanged, reused existing embeddings")
+                        continue
+                except Exception as e:
+                    st.sidebar.warning(f"⚠️ Could not reuse existing {subject} DB: {str(e)}")
+            
             # Delete old DB if exists
             db_path = f"./db/{subject}"
             if os.path.exists(db_path):
                 shutil.rmtree(db_path)
                 st.sidebar.info(f"🗑️ Removed old {subject} database")
             
-            # Remove old agent from session
-            if subject in st.session_state.agents:
-                del st.session_state.agents[subject]
-            
             with st.spinner(f"Creating new embeddings for {subject}..."):
                 try:
                     # Load documents
@@ -76,13 +94,13 @@ for subject in subjects:
                         continue
                     
                     # Build vector store (creates new DB)
-                    vectordb = build_vector_store(subject, docs)
+                    vectordb = build_vector_store(subject, docs, content_hash=file_hash)
                     
                     # Load memory
                     subject_memory = load_persistent_memory(subject)
                     
-                    # Create new agent
-                    agent = BaseAgent(subject, file_path, qa_pipeline, subject_memory)
+                    # Create new agent on top of the freshly built store
+                    agent = BaseAgent(subject, file_path, qa_pipeline, subject_memory, vectordb=vectordb, docs=docs)
                     st.session_state.agents[subject] = agent
                     st.session_state.textbooks_uploaded[subject] = True
                     st.session_state.uploaded_file_hashes[subject] = file_hash
@@ -108,12 +126,23 @@ for subject in subjects:
                         # Load existing vector store
                         vectordb = load_vector_store(subject)
                         
+                        if vectordb is None:
+                            # ✅ Outdated index format: rebuild it from the saved PDF
+                            st.sidebar.info(f"🔄 Rebuilding outdated {subject} database...")
+                            shutil.rmtree(db_path)
+                            
+                            with open(file_path, "rb") as f:
+                                file_hash = hashlib.sha256(f.read()).hexdigest()
+                            
+                            docs = load_documents(file_path)
+                            vectordb = build_vector_store(subject, docs, content_hash=file_hash)
+                        
                         if vectordb:
                             # Load memory
                             subject_memory = load_persistent_memory(subject)
                             
                             # Create agent with existing DB
-                            agent = BaseAgent(subject, file_path, qa_pipeline, subject_memory)
+                            agent = BaseAgent(subject, file_path, qa_pipeline, subject_memory, vectordb=vectordb)
                             st.session_state.agents[subject] = agent
                             st.session_state.textbooks_uploaded[subject] = True
                             
@@ -3,6 +3,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# ✅ Single-threaded BLAS/OpenMP by default: the hot-path numpy ops are tiny,
+# so a thread pool per call costs more than the work. Must be set before
+# numpy/faiss are imported; bulk index builds raise the limit locally.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
 # Ollama model for text generation
 MODEL_NAME = "gemma:2b"   
 
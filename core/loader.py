@@ -1,6 +1,13 @@
+import os
+from functools import lru_cache
 from langchain_community.document_loaders import PyPDFLoader
 
+@lru_cache(maxsize=8)
+def _load_pdf(file_path, mtime):
+    """Parse a PDF once per (path, modification time)."""
+    loader = PyPDFLoader(file_path)
+    return tuple(loader.load())
+
 def load_documents(file_path):
     """Load PDF and return list of documents."""
-    loader = PyPDFLoader(file_path)
-    return loader.load()
+    return list(_load_pdf(file_path, os.path.getmtime(file_path)))
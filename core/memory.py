@@ -1,14 +1,26 @@
 import os, json
+from collections import deque
+
+# Number of recent messages included in prompts
+HISTORY_LIMIT = 10
 
 class ChatMemory:
-    def __init__(self):
+    def __init__(self, max_history: int = HISTORY_LIMIT):
         self.messages = []
+        # ✅ Pre-formatted prompt lines, bounded so prompts don't grow with the session
+        self._formatted = deque(maxlen=max_history)
 
     def add_user_message(self, content):
         self.messages.append({"type": "User", "content": content})
+        self._formatted.append(f"User: {content}")
 
     def add_ai_message(self, content):
         self.messages.append({"type": "AI", "content": content})
+        self._formatted.append(f"AI: {content}")
+
+    def history(self):
+        """Return the most recent messages formatted for a prompt."""
+        return "\n".join(self._formatted)
 
 class PersistentMemory:
     def __init__(self, subject: str):
@@ -0,0 +1,82 @@
+import numpy as np
+from numba import njit
+
+def index_documents(vectordb):
+    """Return the indexed documents in FAISS order (position -> Document)."""
+    ids = vectordb.index_to_docstore_id
+    return [vectordb.docstore.search(ids[i]) for i in range(vectordb.index.ntotal)]
+
+@njit(cache=True, nogil=True)
+def _mmr_select(sim_query, sim_matrix, k, lam):
+    """Greedy MMR kernel: query-pool similarities + pool-pool matrix -> selected positions."""
+    n = sim_query.shape[0]
+    selected = np.empty(k, dtype=np.int64)
+    available = np.ones(n, dtype=np.bool_)
+    
+    first = 0
+    for j in range(1, n):
+        if sim_query[j] > sim_query[first]:
+            first = j
+    selected[0] = first
+    available[first] = False
+    # Running max similarity of every candidate to the selected set
+    max_sel = sim_matrix[first].copy()
+    
+    for s in range(1, k):
+        # Seed from the first available candidate (no -inf sentinel, never returns -1)
+        best = 0
+        while not available[best]:
+            best += 1
+        best_score = lam * sim_query[best] - (1.0 - lam) * max_sel[best]
+        for j in range(best + 1, n):
+            if available[j]:
+                score = lam * sim_query[j] - (1.0 - lam) * max_sel[j]
+                if score > best_score:
+                    best_score = score
+                    best = j
+        selected[s] = best
+        available[best] = False
+        for j in range(n):
+            if sim_matrix[best, j] > max_sel[j]:
+                max_sel[j] = sim_matrix[best, j]
+    
+    return selected
+
+# ✅ Warm-compile at import so the first query doesn't pay the JIT cost
+_mmr_select(np.ones(2, dtype=np.float32), np.eye(2, dtype=np.float32), 2, 0.5)
+
+def mmr_select(query_sims, sim_matrix, k: int, lambda_mult: float):
+    """Greedy MMR over a candidate pool using a precomputed similarity matrix."""
+    k = min(k, len(query_sims))
+    if k <= 0:
+        return []
+    
+    picks = _mmr_select(
+        np.ascontiguousarray(query_sims, dtype=np.float32),
+        np.ascontiguousarray(sim_matrix, dtype=np.float32),
+        k,
+        lambda_mult
+    )
+    return picks.tolist()
+
+def mmr_search(index, q_vec, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5):
+    """Return FAISS positions of the k MMR-selected chunks for a query vector."""
+    q_vec = np.asarray(q_vec, dtype=np.float32)
+    q_vec = q_vec / np.linalg.norm(q_vec)
+    
+    # Candidate pool comes from the FAISS index, same as LangChain's MMR retriever
+    _, ids = index.search(q_vec.reshape(1, -1), fetch_k)
+    pool_idx = ids[0][ids[0] >= 0]
+    if pool_idx.size == 0:
+        return []
+    
+    # Decode only the candidate rows, so a memory-mapped index stays mostly on disk
+    pool_vecs = np.ascontiguousarray(index.reconstruct_batch(pool_idx), dtype=np.float32)
+    norms = np.linalg.norm(pool_vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    pool_vecs /= norms
+    query_sims = pool_vecs @ q_vec
+    sim_matrix = pool_vecs @ pool_vecs.T  # One gemm for every candidate pair
+    
+    picks = mmr_select(query_sims, sim_matrix, k, lambda_mult)
+    return pool_idx[picks].tolist()
@@ -1,17 +1,59 @@
 import os
+import uuid
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import httpx
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from threadpoolctl import threadpool_limits
 
 # Ollama embeddings model
 EMBEDDING_MODEL_NAME = "nomic-embed-text"
 
-def build_vector_store(subject: str, docs, persist_root: str = "./db"):
+_EMBEDDINGS = None
+
+def get_embeddings():
+    """Return the shared OllamaEmbeddings client (one warm keep-alive connection pool)."""
+    global _EMBEDDINGS
+    if _EMBEDDINGS is None:
+        _EMBEDDINGS = OllamaEmbeddings(
+            model=EMBEDDING_MODEL_NAME,
+            client_kwargs={"timeout": 60, "limits": httpx.Limits(max_keepalive_connections=8)}
+        )
+    return _EMBEDDINGS
+
+# HNSW graph parameters (sub-linear search instead of a flat scan); vectors stored as fp16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Chunks per embed_documents call, and how many calls are in flight at once
+EMBED_BATCH_SIZE = 64
+EMBED_WORKERS = 4
+
+# Hash of the source PDF the persisted index was built from
+CONTENT_HASH_FILE = "content.hash"
+
+def _embed_texts(embeddings, texts):
+    """Embed texts in fixed-size batches, overlapping a few Ollama requests."""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+        results = pool.map(embeddings.embed_documents, batches)
+        vecs = [v for batch in results for v in batch]
+    
+    return np.asarray(vecs, dtype=np.float32)
+
+def build_vector_store(subject: str, docs, persist_root: str = "./db", content_hash: str = None):
     persist_dir = os.path.join(persist_root, subject)
     os.makedirs(persist_dir, exist_ok=True)
     
-    # ✅ Use OllamaEmbeddings
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
+    # ✅ Use the shared OllamaEmbeddings client
+    embeddings = get_embeddings()
     
     # ✅ IMPROVED: Larger chunks for Math to keep problems complete
     if subject.lower() == "math":
@@ -37,8 +79,31 @@ def build_vector_store(subject: str, docs, persist_root: str = "./db"):
         meta.setdefault("chunk_id", i)  # ✅ Add chunk ID for debugging
         chunk.metadata = meta
     
-    # Build FAISS index
-    vectordb = FAISS.from_documents(chunks, embeddings)
+    if not chunks:
+        raise ValueError(f"No text chunks extracted for {subject}")
+    
+    # ✅ Build an HNSW index over normalized vectors (L2 ranking == cosine ranking)
+    vecs = _embed_texts(embeddings, [c.page_content for c in chunks])
+    
+    # ✅ fp16 scalar-quantized storage halves the bytes streamed per search
+    index = faiss.IndexHNSWSQ(vecs.shape[1], faiss.ScalarQuantizer.QT_fp16, HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    
+    # ✅ Bulk build: lift the process-wide single-thread default (see config.py)
+    with threadpool_limits(limits=os.cpu_count()):
+        faiss.normalize_L2(vecs)
+        index.train(vecs)
+        index.add(vecs)
+    
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    vectordb = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+        index_to_docstore_id=dict(enumerate(ids)),
+        normalize_L2=True
+    )
     
     # Persist FAISS index
     index_path = os.path.join(persist_dir, "faiss_index")
@@ -46,6 +111,11 @@ def build_vector_store(subject: str, docs, persist_root: str = "./db"):
     
     print(f"[VectorStore] Saved index to {index_path}")
     
+    # ✅ Written after the index so a partial build never looks up to date
+    if content_hash:
+        with open(os.path.join(persist_dir, CONTENT_HASH_FILE), "w") as f:
+            f.write(content_hash)
+    
     return vectordb
 
 def load_vector_store(subject: str, persist_root: str = "./db"):
@@ -55,7 +125,44 @@ def load_vector_store(subject: str, persist_root: str = "./db"):
     if not os.path.exists(index_path):
         return None
     
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
-    vectordb = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    # ✅ Indexes without a content hash predate the normalized HNSW format: treat as stale
+    if read_content_hash(subject, persist_root) is None:
+        print(f"[VectorStore] Stale index for {subject} (no content hash), needs rebuild")
+        return None
+    
+    embeddings = get_embeddings()
+    
+    # ✅ Prefetch the index file into the page cache, then memory-map its flat codes
+    index_file = os.path.join(index_path, "index.faiss")
+    if hasattr(os, "posix_fadvise"):
+        with open(index_file, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC)
+    
+    if not isinstance(index, faiss.IndexHNSW):
+        print(f"[VectorStore] Stale index for {subject} ({type(index).__name__}), needs rebuild")
+        return None
+    
+    # Docstore + id mapping as written by FAISS.save_local (our own file)
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    
+    vectordb = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        normalize_L2=True
+    )
     
     return vectordb
+
+def read_content_hash(subject: str, persist_root: str = "./db"):
+    """Return the source hash stored next to a subject's index, or None."""
+    hash_path = os.path.join(persist_root, subject, CONTENT_HASH_FILE)
+    
+    if not os.path.exists(hash_path):
+        return None
+    
+    with open(hash_path) as f:
+        return f.read().strip()